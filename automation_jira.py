@@ -17,13 +17,20 @@ Buenas prácticas:
 
 import os
 import sys
+import hashlib
+import functools
+import inspect
+from pathlib import Path
 import smtplib
 import random
+from collections import defaultdict, namedtuple
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta, date
 from zoneinfo import ZoneInfo  # Python 3.9+
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from email.message import EmailMessage
 from dotenv import load_dotenv, find_dotenv
 
 # para probar en que liena se imprime una funcion con 
@@ -34,11 +41,21 @@ import traceback
 # 1. CONFIGURACIÓN
 # ================================================================
 
-def load_settings():
+@functools.lru_cache(maxsize=None)
+def _find_dotenv_path() -> str:
+    """
+    Busca el .env subiendo desde el cwd una sola vez por proceso.
+    """
+    return find_dotenv(usecwd=True)
+
+
+def load_settings(dotenv_path: str | None = None):
     """
     Carga variables desde .env si existe y valida requeridas.
+    Si no se indica `dotenv_path`, se busca el .env (una sola vez por proceso).
     """
-    load_dotenv(find_dotenv(usecwd=True), override=False)
+    load_dotenv(dotenv_path or _find_dotenv_path(), override=False)
+    env = os.environ
     required_vars = [
         "JIRA_BASE_URL",
         "JIRA_EMAIL",
@@ -53,18 +70,20 @@ def load_settings():
 
    
 
-    cfg = {} # almacena todas las configuraciones necesarias
-    for var in required_vars:
-        val = os.getenv(var)
-        if not val:
-            print(f"[ERROR] Falta variable de entorno: {var}", file=sys.stderr)
-            sys.exit(1)
-        cfg[var] = val
+    # Reporta todas las variables faltantes de una vez
+    missing = [var for var in required_vars if not env.get(var)]
+    if missing:
+        print(f"[ERROR] Faltan variables de entorno: {', '.join(missing)}", file=sys.stderr)
+        sys.exit(1)
+
+    cfg = {var: env[var] for var in required_vars} # almacena todas las configuraciones necesarias
 
     # Opcionales / defaults
-    cfg["SMTP_USERNAME"] = os.getenv("SMTP_USERNAME", cfg["SENDER_EMAIL"])
-    cfg["SMTP_PASSWORD"] = os.getenv("SMTP_PASSWORD", "")
-    cfg["DRY_RUN"] = os.getenv("DRY_RUN", "true").lower() == "true"
+    cfg["SMTP_USERNAME"] = env.get("SMTP_USERNAME", cfg["SENDER_EMAIL"])
+    cfg["SMTP_PASSWORD"] = env.get("SMTP_PASSWORD", "")
+    cfg["DRY_RUN"] = env.get("DRY_RUN", "true").lower() == "true"
+    cfg["JIRA_PAGE_SIZE"] = env.get("JIRA_PAGE_SIZE", "1000")
+    cfg["JIRA_RESOLUTION_PREFILTER"] = env.get("JIRA_RESOLUTION_PREFILTER", "false").lower() == "true"
 
     # Casting y validaciones
     try:
@@ -72,6 +91,9 @@ def load_settings():
     except ValueError:
         print("[ERROR] PER_ANALYST debe ser un entero.", file=sys.stderr)
         sys.exit(1)
+    if cfg["PER_ANALYST"] < 1:
+        print("[ERROR] PER_ANALYST debe ser un entero mayor o igual a 1.", file=sys.stderr)
+        sys.exit(1)
 
     try:
         cfg["SMTP_PORT"] = int(cfg["SMTP_PORT"])
@@ -79,6 +101,12 @@ def load_settings():
         print("[ERROR] SMTP_PORT debe ser un entero.", file=sys.stderr)
         sys.exit(1)
 
+    try:
+        cfg["JIRA_PAGE_SIZE"] = int(cfg["JIRA_PAGE_SIZE"])
+    except ValueError:
+        print("[ERROR] JIRA_PAGE_SIZE debe ser un entero.", file=sys.stderr)
+        sys.exit(1)
+
     return cfg  # retornar todas las vrbles de entorno almacenadas
 
 
@@ -87,10 +115,12 @@ def load_settings():
 # ================================================================
 
 # ---- esta funcion que consulta en el portal de Jira la informacion requeridad 
-def build_jql_relative(project_keys: str) -> str:
+def build_jql_relative(project_keys: str, resolution_prefilter: bool = False) -> str:
     """
     Usa el día calendario 'ayer' según la zona del usuario en Jira,
     evitando manejar timestamps y husos horarios en el script.
+    Con `resolution_prefilter` agrega un filtro indexado por `resolutiondate`
+    (ver supuesto abajo); por defecto está desactivado.
     """
     projects = ",".join([p.strip() for p in project_keys.split(",") if p.strip()])
     # query que extrae los datos de jira  
@@ -98,52 +128,176 @@ def build_jql_relative(project_keys: str) -> str:
     # (0), los de hoy 
 
     # consulta que me trae todas las ussues en estado final en el workflow
-    return (
-        f"project in ({projects}) "
-        f'AND status CHANGED TO "Resuelto" DURING (startOfDay(-1), endOfDay(-1))'
-    )
+    jql = f"project in ({projects}) "
+
+    # `resolutiondate` es un campo indexado: reduce los candidatos antes de que
+    # Jira revise el historial de cambios (CHANGED ... DURING).
+    # SUPUESTO: el workflow asigna la resolución al pasar a "Resuelto". Si un
+    # issue llega a "Resuelto" sin resolución, o con una puesta antes de ayer,
+    # este filtro lo excluye de la auditoría. Solo activarlo (JIRA_RESOLUTION_PREFILTER)
+    # tras confirmar ese comportamiento en el workflow.
+    if resolution_prefilter:
+        jql += "AND resolutiondate >= startOfDay(-1) "
+
+    return jql + 'AND status CHANGED TO "Resuelto" DURING (startOfDay(-1), endOfDay(-1))'
 
 
     
-def fetch_all_issues(base_url: str, auth: tuple, jql: str):
+def build_session(pool_size: int = 4) -> requests.Session:
     """
-        Llama al API de Jira para obtener todos los issues que cumplen con la JQL.
-        Usa paginación porque Jira devuelve máximo 100 resultados por petición.
-        Pide solo los campos necesarios y añade timeout.
+    Crea una sesión HTTP reutilizable:
+    - Conexiones keep-alive para reutilizar TCP/TLS entre páginas.
+    - Reintentos con backoff exponencial ante 429 (rate limit) y errores 5xx.
+    - Respuestas comprimidas (gzip/deflate) para reducir bytes en red.
     """
-    issues = []
-    start_at = 0
-    max_results = 100
+    retry = Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),  # la búsqueda por POST es de solo lectura
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
     session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate",
+        "Content-Type": "application/json",
+    })
+    return session
 
-    base_url = base_url.strip().rstrip('/')
-    fields = ["key", "summary", "assignee", "reporter", "resolutiondate"]
 
-    while True:
-        url = f"{base_url}/rest/api/3/search/jql"
-        params = {
-            "jql": jql,
-            "startAt": start_at,
-            "maxResults": max_results,
-            "fields": fields,
-        }
+class JiraAPIError(Exception):
+    """
+    Error HTTP del API de Jira; conserva el status para poder distinguirlo.
+    """
 
-        resp = session.get(url, params=params, auth=auth, headers={"Accept": "application/json"}, timeout=30)
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"Error en Jira API: {status_code} {text}")
+        self.status_code = status_code
 
-        if resp.status_code != 200:
-            raise Exception(f"Error en Jira API: {resp.status_code} {resp.text}")
 
-        try:
-            data = resp.json()
-        except ValueError:
-            raise Exception(f"Respuesta no es JSON válido: {resp.text}")
+def _fetch_page(session: requests.Session, url: str, auth: tuple, body: dict, report_size: bool = False) -> dict:
+    """
+    Pide una página de resultados (POST con cuerpo JSON) y devuelve el JSON ya parseado.
+    Serializa y parsea con orjson, bastante más rápido que `json` en páginas grandes.
+    Con `report_size` muestra la compresión usada y el tamaño en red vs. descomprimido.
+    """
+    resp = session.post(url, data=orjson.dumps(body), auth=auth, timeout=30)
+
+    if resp.status_code != 200:
+        raise JiraAPIError(resp.status_code, resp.text)
+
+    if report_size:
+        encoding = resp.headers.get("Content-Encoding", "identity")
+        wire_size = resp.headers.get("Content-Length", "?")
+        print(f"[INFO] Respuesta de Jira ({encoding}): {wire_size} bytes en red -> {len(resp.content)} bytes JSON")
+
+    try:
+        return orjson.loads(resp.content)
+    except orjson.JSONDecodeError:
+        raise Exception(f"Respuesta no es JSON válido: {resp.text}")
+
 
-        issues.extend(data.get("issues", []))
+CACHE_DIR = Path(".cache")
 
-        total = data.get("total", 0)
-        if start_at + max_results >= total:
-            break
-        start_at += max_results
+
+def cache_enabled() -> bool:
+    """
+    El caché local de Jira solo se usa con JIRA_CACHE=1 (desarrollo / DRY_RUN).
+    """
+    return os.getenv("JIRA_CACHE") == "1"
+
+
+def disk_cached(fetch):
+    """
+    Decorador para desarrollo / DRY_RUN: guarda en disco los issues devueltos
+    por `fetch` en .cache/<sha1(base_url + jql + fields)>.json. Como la JQL es relativa a 'ayer',
+    el caché vale hasta la medianoche de Bogotá.
+    Solo se activa con JIRA_CACHE=1.
+    """
+    signature = inspect.signature(fetch)
+
+    @functools.wraps(fetch)
+    def wrapper(base_url: str, auth: tuple, jql: str, *args, **kwargs):
+        if not cache_enabled():
+            return fetch(base_url, auth, jql, *args, **kwargs)
+
+        # Se enlazan los argumentos para que `fields` cuente igual si llega
+        # por posición, por nombre o con su valor por defecto
+        bound = signature.bind(base_url, auth, jql, *args, **kwargs)
+        bound.apply_defaults()
+        fields = ",".join(bound.arguments["fields"])
+        key = hashlib.sha1(f"{base_url}\n{jql}\n{fields}".encode("utf-8")).hexdigest()
+        path = CACHE_DIR / f"{key}.json"
+        today_start = datetime.now(ZoneInfo("America/Bogota")).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+
+        if path.exists() and path.stat().st_mtime >= today_start.timestamp():
+            print(f"[INFO] Usando caché local de Jira: {path}")
+            return orjson.loads(path.read_bytes())
+
+        issues = fetch(base_url, auth, jql, *args, **kwargs)
+        CACHE_DIR.mkdir(exist_ok=True)
+        path.write_bytes(orjson.dumps(issues))
+        return issues
+
+    return wrapper
+
+
+@disk_cached
+def fetch_all_issues(base_url: str, auth: tuple, jql: str, max_results: int = 1000,
+                     fields=("summary", "assignee", "resolutiondate")):
+    """
+        Llama al API de Jira para obtener todos los issues que cumplen con la JQL.
+        El endpoint /search/jql pagina con `nextPageToken` / `isLast` (no usa
+        `startAt` ni devuelve `total`), así que las páginas se piden en orden,
+        encadenando el token de cada respuesta, hasta `isLast`.
+        Jira Cloud puede recortar el tamaño de página solicitado.
+        Usa POST con la JQL en el cuerpo (evita URLs enormes) y pide solo los
+        campos indicados en `fields`; `key` siempre viene en el nivel superior.
+        Añade timeout.
+    """
+    base_url = base_url.strip().rstrip('/')
+    url = f"{base_url}/rest/api/3/search/jql"
+    body = {
+        "jql": jql,
+        "maxResults": max_results,
+        "fields": list(fields),
+    }
+
+    issues = []
+    with build_session() as session:
+        while True:
+            first = "nextPageToken" not in body
+            data = _fetch_page(session, url, auth, body, report_size=first)
+            page = data.get("issues", [])
+            issues.extend(page)
+
+            next_token = data.get("nextPageToken")
+            is_last = data.get("isLast", not next_token)
+            if is_last:
+                break
+            if not next_token:
+                # Sin token no hay forma de seguir: mejor fallar que auditar a medias
+                raise Exception(
+                    f"Respuesta de Jira incompleta: isLast=false sin nextPageToken "
+                    f"({len(issues)} issues recuperados)."
+                )
+
+            # En la primera página detectamos si Jira recortó el tamaño solicitado
+            if first and len(page) < max_results:
+                print(
+                    f"[WARN] Jira limitó el tamaño de página a {len(page)} "
+                    f"(solicitado: {max_results}).",
+                    file=sys.stderr,
+                )
+
+            body["nextPageToken"] = next_token
 
     return issues
 
@@ -152,43 +306,102 @@ def fetch_all_issues(base_url: str, auth: tuple, jql: str):
 # ================================================================
 # 3. PROCESAMIENTO DE ISSUES
 # ================================================================
-# resumen estadisticas agsinadas
-def summarize_assignee_stats(issues):
-    with_assignee = sum(1 for i in issues if i.get("fields", {}).get("assignee"))
-    without_assignee = len(issues) - with_assignee
-    print(f"[INFO] Con assignee: {with_assignee} | Sin assignee: {without_assignee}")
-   
+# Registro liviano por issue: se extrae una sola vez y se reutiliza al agrupar y renderizar
+Issue = namedtuple("Issue", "key summary assignee_id assignee_name url")
+
+UNASSIGNED_ID = "UNASSIGNED"
+UNASSIGNED_NAME = "(Sin asignar)"
 
-def group_by_assignee(issues):
+
+def normalize_issues(issues, base_url: str):
     """
-    Agrupa issues por analista (assignee).
-    Incluye un grupo especial para 'Sin asignar'.
-    Clave: (accountId, displayName) o ("UNASSIGNED", "(Sin asignar)")
+    Convierte la respuesta cruda de Jira en una lista plana de `Issue`.
+    Los nombres se memorizan por accountId para no duplicar cadenas
+    y el link al issue se arma aquí una sola vez para ambos renderizados.
     """
-    groups = {}
+    browse_url = f"{base_url.strip().rstrip('/')}/browse/"
+    names = {}  # accountId -> displayName
+    normalized = []
     for issue in issues:
-        fields = issue.get("fields", {})
+        fields = issue.get("fields") or {}
         assignee = fields.get("assignee")
         if not assignee:
-            key = ("UNASSIGNED", "(Sin asignar)")
-            name = "(Sin asignar)"
+            assignee_id, assignee_name = UNASSIGNED_ID, UNASSIGNED_NAME
+        else:
+            assignee_id = assignee["accountId"]
+            assignee_name = names.get(assignee_id)
+            if assignee_name is None:
+                assignee_name = names[assignee_id] = assignee.get("displayName") or "Desconocido"
+        key = issue.get("key", "(sin clave)")
+        normalized.append(Issue(
+            key=key,
+            summary=fields.get("summary") or "(sin resumen)",
+            assignee_id=assignee_id,
+            assignee_name=assignee_name,
+            url=browse_url + key,
+        ))
+    return normalized
+
+
+def partition_issues(issues, per_analyst: int):
+    """
+    Una sola pasada sobre los issues (ya normalizados):
+    - Agrupa por analista (assignee), con un grupo especial para 'Sin asignar'.
+      Clave: (accountId, displayName) o ("UNASSIGNED", "(Sin asignar)")
+    - Selecciona N issues aleatorios por analista con muestreo de reservorio
+      (Algoritmo R), guardando como máximo N issues por analista.
+      Si un analista resolvió menos de N issues, devuelve todos los que tenga.
+    - Cuenta issues con y sin assignee.
+    Devuelve (selection, with_assignee, without_assignee).
+    """
+    rng = random.Random()
+    selection = defaultdict(list)  # clave -> reservorio (máximo N issues)
+    seen = defaultdict(int)        # clave -> issues vistos hasta ahora
+    for issue in issues:
+        key = (issue.assignee_id, issue.assignee_name)
+        count = seen[key]
+        if count < per_analyst:
+            selection[key].append(issue)
         else:
-            key = (assignee["accountId"], assignee.get("displayName", "Desconocido"))
-            name = assignee.get("displayName", "Desconocido")
-        groups.setdefault((key[0], name), []).append(issue)
-    return groups
+            j = rng.randint(0, count)
+            if j < per_analyst:
+                selection[key][j] = issue
+        seen[key] = count + 1
 
+    # Los conteos salen del propio reservorio, sin recorrer de nuevo los issues
+    without_assignee = seen.get((UNASSIGNED_ID, UNASSIGNED_NAME), 0)
+    with_assignee = len(issues) - without_assignee
+    return selection, with_assignee, without_assignee
 
-def pick_random_per_analyst(groups, per_analyst: int):
+
+def hydrate_selection(base_url: str, auth: tuple, selection, **fetch_kwargs):
     """
-    Selecciona N issues aleatorios por analista.
-    Si un analista resolvió menos de N issues, devuelve todos los que tenga.
+    Segunda etapa de la consulta: vuelve a pedir a Jira solo los issues
+    seleccionados (`key in (...)`, el filtro más barato) con los campos
+    que se muestran, y los reemplaza en la selección manteniendo los grupos.
+    Si Jira rechaza la JQL con 400 (p.ej. un issue borrado entre las dos
+    etapas hace que `key in (...)` falle), se avisa y se devuelve la selección
+    original, cuyos issues se muestran "(sin resumen)". Un issue que no vuelva
+    en una respuesta válida también conserva su registro original.
     """
-    selection = {}
-    for (account_id, name), items in groups.items():
-        chosen = random.sample(items, k=min(per_analyst, len(items)))
-        selection[(account_id, name)] = chosen
-    return selection
+    keys = [issue.key for items in selection.values() for issue in items]
+    if not keys:
+        return selection
+
+    jql = f"key in ({','.join(keys)})"
+    # Sin caché: la JQL cambia con cada muestreo y solo dejaría archivos huérfanos
+    try:
+        fetched = fetch_all_issues.__wrapped__(base_url, auth, jql, fields=("summary", "assignee"), **fetch_kwargs)
+    except JiraAPIError as e:
+        if e.status_code != 400:
+            raise
+        print(f"[WARN] No se pudieron completar los issues seleccionados: {e}", file=sys.stderr)
+        return selection
+    by_key = {issue.key: issue for issue in normalize_issues(fetched, base_url)}
+    return {
+        group: [by_key.get(issue.key, issue) for issue in items]
+        for group, items in selection.items()
+    }
 
 
 # ================================================================
@@ -197,24 +410,18 @@ def pick_random_per_analyst(groups, per_analyst: int):
 from html import escape
 from datetime import date
 
-def build_email_html(base_url: str, target_date: date, selection, total_issues: int) -> str:
-    """
-    funcion para renderizar el html en el correo
-    """
-    date_str = target_date.isoformat()
-    preheader = f"Total de incidentes resueltos: {total_issues} — {date_str}"
-
-    # Paleta y fuentes 
-    bg = "#faf6fa"
-    card_bg = "#ffffff"
-    text = "#0f172a"
-    text_muted = "#334155"
-    border = "#eaeef2"
-    border_soft = "#e5e7eb"
-    link = "#0b57d0"
-
-    # view html que se mostrara en el correo
-    html_content = f"""\
+# Paleta y fuentes 
+_BG = "#faf6fa"
+_CARD_BG = "#ffffff"
+_TEXT = "#0f172a"
+_TEXT_MUTED = "#334155"
+_BORDER = "#eaeef2"
+_BORDER_SOFT = "#e5e7eb"
+_LINK = "#0b57d0"
+
+# Plantillas del correo: la paleta se sustituye una sola vez al cargar el módulo;
+# en cada envío solo se rellenan los campos variables ({{...}}) con format_map.
+_HEAD_HTML = f"""\
         <!DOCTYPE html>
         <html lang="es">
         <head>
@@ -223,71 +430,59 @@ def build_email_html(base_url: str, target_date: date, selection, total_issues:
             <meta name="color-scheme" content="light only" />
             <title>Auditoría de incidentes</title>
         </head>
-        <body style="margin:0; padding:0; background-color:{bg};">
+        <body style="margin:0; padding:0; background-color:{_BG};">
             
             
             <!-- preheader (oculto) -->
             <div style="display:none; overflow:hidden; line-height:1px; opacity:0; max-height:0; max-width:0; mso-hide:all;">
-            {escape(preheader)}
+            {{preheader}}
             </div>
 
-            <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="100%" style="background-color:{bg};">
+            <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="100%" style="background-color:{_BG};">
             <tr>
                 <td align="center" style="padding:24px;">
-                <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="600" style="width:600px; max-width:600px; background:{card_bg}; border:1px solid {border}; border-radius:8px;">
+                <table role="presentation" cellpadding="0" cellspacing="0" border="0" width="600" style="width:600px; max-width:600px; background:{_CARD_BG}; border:1px solid {_BORDER}; border-radius:8px;">
                     <tr>
-                    <td style="padding:24px; font-family:-apple-system,Segoe UI,Roboto,Arial,Helvetica,sans-serif; color:{text}; font-size:14px; line-height:1.6;">
-                        <h2 style="margin:0 0 8px 0; font-size:20px; line-height:1.3; color:{text};">
-                        Auditoría de incidentes resueltos el {escape(date_str)}
+                    <td style="padding:24px; font-family:-apple-system,Segoe UI,Roboto,Arial,Helvetica,sans-serif; color:{_TEXT}; font-size:14px; line-height:1.6;">
+                        <h2 style="margin:0 0 8px 0; font-size:20px; line-height:1.3; color:{_TEXT};">
+                        Auditoría de incidentes resueltos el {{date_str}}
                         </h2>
-                        <p style="margin:0 0 16px 0; color:{text_muted};">
-                        Total de incidentes resueltos: <strong style="color:{text};">{total_issues}</strong>
+                        <p style="margin:0 0 16px 0; color:{_TEXT_MUTED};">
+                        Total de incidentes resueltos: <strong style="color:{_TEXT};">{{total_issues}}</strong>
                         </p>
      """
 
-    # Mensaje si no hay selección
-    if not selection:
-         html_content += f"""\
-            <p style="margin:0; color:{text_muted};">
+# Mensaje si no hay selección
+_EMPTY_HTML = f"""\
+            <p style="margin:0; color:{_TEXT_MUTED};">
             <em>No se encontraron incidentes con analista asignado. Es posible que los incidentes estén sin asignar o que el filtro no aplique.</em>
             </p>
         """
 
-    # Bloques por responsable
-    # Ordenar por displayName de analista
-    for (account_id, name), items in sorted(selection.items(), key=lambda kv: kv[0][1].lower()):
-        safe_name = escape(name or "(Sin asignar)")
-        count = len(items)
-        html_content += f"""\
-                <div style="margin:16px 0; padding:12px; border:1px solid {border_soft}; border-radius:8px;">
-                  <h3 style="margin:0 0 8px 0; font-size:16px; color:{text};">
-                    {safe_name} <span style="color:{text_muted};">({count})</span>
+_ANALYST_BLOCK_OPEN = f"""\
+                <div style="margin:16px 0; padding:12px; border:1px solid {_BORDER_SOFT}; border-radius:8px;">
+                  <h3 style="margin:0 0 8px 0; font-size:16px; color:{_TEXT};">
+                    {{safe_name}} <span style="color:{_TEXT_MUTED};">({{count}})</span>
                   </h3>
                   <ol style="margin:0; padding-left:20px;">
           """
-        for issue in items:
-            key = escape(issue.get("key", "(sin clave)"))
-            fields = issue.get("fields", {}) or {}
-            summary = escape(fields.get("summary", "(sin resumen)"))
-            assignee = fields.get("assignee")
-            assignee_name = escape((assignee or {}).get("displayName") or "(Sin asignar)")
-            url = f"{base_url}/browse/{key}"
-
-            html_content += f"""\
+
+_LI_TEMPLATE = f"""\
                     <li style="margin:0 0 6px 0;">
-                      <a href="{url}" style="color:{link}; text-decoration:none;">{key}</a>
-                      &nbsp;—&nbsp;{summary}
-                      &nbsp;—&nbsp;<strong style="color:{text};">{assignee_name}</strong>
+                      <a href="{{url}}" style="color:{_LINK}; text-decoration:none;">{{key}}</a>
+                      &nbsp;—&nbsp;{{summary}}
+                      &nbsp;—&nbsp;<strong style="color:{_TEXT};">{{assignee_name}}</strong>
                     </li>
              """
-        html_content += """\
+
+_ANALYST_BLOCK_CLOSE = """\
                   </ol>
                 </div>
          """
 
-    # Cierre de tarjetas y wrapper
-    html_content += f"""\
-                <p style="margin:16px 0 0 0; color:{text_muted}; font-size:12px;">
+# Cierre de tarjetas y wrapper
+_FOOTER_HTML = f"""\
+                <p style="margin:16px 0 0 0; color:{_TEXT_MUTED}; font-size:12px;">
                   Reporte generado automáticamente. No responder a este correo.
                 </p>
               </td>
@@ -300,58 +495,158 @@ def build_email_html(base_url: str, target_date: date, selection, total_issues:
   </body>
 </html>
 """
+
+
+def build_email_html(target_date: date, selection, total_issues: int, *, out=None) -> str | None:
+    """
+    funcion para renderizar el html en el correo
+    `selection`: lista de pares ((accountId, nombre), issues) ya ordenada.
+    Si se pasa `out` (archivo/stream de texto), escribe ahí cada fragmento
+    y devuelve None, sin armar el html completo en memoria.
+    """
+    date_str = target_date.isoformat()
+    preheader = f"Total de incidentes resueltos: {total_issues} — {date_str}"
+
+    if out is not None:
+        append = out.write
+    else:
+        # Fragmentos del html; se unen una sola vez al final (evita concatenaciones cuadráticas)
+        parts = []
+        append = parts.append
+
+    # view html que se mostrara en el correo
+    append(_HEAD_HTML.format_map({
+        "preheader": escape(preheader),
+        "date_str": escape(date_str),
+        "total_issues": total_issues,
+    }))
+
+    if not selection:
+        append(_EMPTY_HTML)
+
+    li_template = _LI_TEMPLATE.format_map
+
+    # Bloques por responsable (ya ordenados por displayName en main)
+    for (account_id, name), items in selection:
+        append(_ANALYST_BLOCK_OPEN.format_map({
+            "safe_name": escape(name or UNASSIGNED_NAME),
+            "count": len(items),
+        }))
+        for issue in items:
+            append(li_template({
+                "url": escape(issue.url),
+                "key": escape(issue.key),
+                "summary": escape(issue.summary),
+                "assignee_name": escape(issue.assignee_name),
+            }))
+        append(_ANALYST_BLOCK_CLOSE)
+
+    append(_FOOTER_HTML)
+
+    if out is not None:
+        return None
     
-    return html_content # html listo para pintar en el correo
+    return "".join(parts) # html listo para pintar en el correo
 
-# envio de correo
-def send_email(cfg, subject: str, html_body: str):
+# conexion SMTP reutilizable
+class Mailer:
     """
-    Envía correo usando servidor SMTP.
-    Soporta múltiples destinatarios en RECIPIENT_EMAIL (separados por coma).
-    En DRY_RUN, guarda vista previa HTML en archivo local.
+    Abre la conexión SMTP una sola vez (ehlo/starttls/login) y permite
+    varios envíos sobre ella; así el handshake TLS y la autenticación
+    no se repiten si se mandan varios correos en la misma ejecución.
+
+        with Mailer(cfg) as mailer:
+            mailer.send(subject, html_body, recipients)
+    """
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.server = None
+
+    def __enter__(self):
+        cfg = self.cfg
+        self.server = smtplib.SMTP(cfg["SMTP_SERVER"], cfg["SMTP_PORT"])
+        try:
+            self.server.ehlo()
+            self.server.starttls()
+            self.server.ehlo()
+            if cfg["SMTP_PASSWORD"]:
+                self.server.login(cfg["SMTP_USERNAME"], cfg["SMTP_PASSWORD"])
+        except Exception:
+            self.server.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.server.quit()
+        except smtplib.SMTPServerDisconnected:
+            pass
+        finally:
+            self.server.close()
+            self.server = None
+
+    def send(self, subject: str, html_body: str, recipients):
+        """
+        Envía un correo HTML a los destinatarios por la conexión abierta.
+        """
+        msg = EmailMessage()
+        msg["Subject"] = subject
+        msg["From"] = self.cfg["SENDER_EMAIL"]
+        msg["To"] = ", ".join(recipients)
+        msg.set_content(html_body, subtype="html")
+        self.server.send_message(msg)
+
+
+def get_recipients(cfg):
+    """
+    Permite múltiples destinatarios en RECIPIENT_EMAIL (separados por coma).
+    Termina el programa si no hay ninguno válido.
     """
-    # Permite múltiples destinatarios
     recipients = [e.strip() for e in cfg["RECIPIENT_EMAIL"].split(",") if e.strip()]
     if not recipients:
         print("[ERROR] RECIPIENT_EMAIL no tiene destinatarios válidos.", file=sys.stderr)
         sys.exit(1)
+    return recipients
 
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = subject
-    msg["From"] = cfg["SENDER_EMAIL"]
-    msg["To"] = ", ".join(recipients)
 
-    part = MIMEText(html_body, "html")
-    msg.attach(part) 
+# vista previa en DRY_RUN
+def save_preview(cfg, target_date: date, selection, total_issues: int):
+    """
+    En DRY_RUN no se envía correo: el HTML se escribe directo al archivo
+    de vista previa, sin armarlo completo en memoria.
+    """
+    get_recipients(cfg)  # valida la configuración igual que en un envío real
 
-    if cfg["DRY_RUN"]:
+    print("\n[DRY_RUN] No se envió correo.")
+    fname = f"auditoria_preview_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
+    with open(fname, "w", encoding="utf-8") as f:
+        build_email_html(target_date, selection, total_issues, out=f)
+    print(f"[DRY_RUN] Vista previa guardada en: {fname}")
 
-        print("\n[DRY_RUN] No se envió correo. Contenido MIME (recortado).")
-        # Guarda una copia del HTML para revisión rápida
-        fname = f"auditoria_preview_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
-        with open(fname, "w", encoding="utf-8") as f:
-            f.write(html_body)
-        print(f"[DRY_RUN] Vista previa guardada en: {fname}")
-        return
 
-    with smtplib.SMTP(cfg["SMTP_SERVER"], cfg["SMTP_PORT"]) as server:
-        server.ehlo()
-        server.starttls()
-        server.ehlo()
-        if cfg["SMTP_PASSWORD"]:
-            server.login(cfg["SMTP_USERNAME"], cfg["SMTP_PASSWORD"])
-        server.sendmail(cfg["SENDER_EMAIL"], recipients, msg.as_string())
+# envio de correo
+def send_email(cfg, subject: str, html_body: str):
+    """
+    Envía correo usando servidor SMTP.
+    Soporta múltiples destinatarios en RECIPIENT_EMAIL (separados por coma).
+    """
+    recipients = get_recipients(cfg)
+
+    with Mailer(cfg) as mailer:
+        mailer.send(subject, html_body, recipients)
 
 
 # ================================================================
 # Funcion para imprimir en consola el resultado
 # ================================================================
-def print_console_summary(base_url: str, selection, total_issues: int):
+def print_console_summary(selection, total_issues: int):
     """
     Imprime en consola un resumen legible:
     - Total de issues
     - Bloques por responsable (incluye '(Sin asignar)')
     - Por issue: KEY — resumen — responsable — URL
+    `selection`: lista de pares ((accountId, nombre), issues) ya ordenada.
     """
     def _short(text: str, maxlen: int = 100) -> str:
         if text is None:
@@ -366,17 +661,11 @@ def print_console_summary(base_url: str, selection, total_issues: int):
         print("No se encontraron issues con analista asignado para el rango.")
         return
 
-    # Ordenar por nombre del analista
-    for (account_id, name), issues in sorted(selection.items(), key=lambda kv: kv[0][1].lower()):
+    # Ya viene ordenado por nombre del analista
+    for (account_id, name), issues in selection:
         print(f"\n{name} ({len(issues)}):")
         for issue in issues:
-            key = issue.get("key", "(sin clave)")
-            fields = issue.get("fields", {}) or {}
-            summary = _short(fields.get("summary"))
-            assignee = fields.get("assignee")
-            assignee_name = (assignee or {}).get("displayName") or "(Sin asignar)"
-            url = f"{base_url}/browse/{key}"
-            print(f"  - {key} — {summary} — Resp.: {assignee_name} — {url}")
+            print(f"  - {issue.key} — {_short(issue.summary)} — Resp.: {issue.assignee_name} — {issue.url}")
 
 # ================================================================
 # 5. PROGRAMA PRINCIPAL
@@ -398,37 +687,53 @@ def main():
     cfg = load_settings()
 
     # JQL para 'ayer' relativo (en Jira)
-    jql = build_jql_relative(cfg["JIRA_PROJECT_KEYS"])
+    jql = build_jql_relative(cfg["JIRA_PROJECT_KEYS"], cfg["JIRA_RESOLUTION_PREFILTER"])
    # ver en consola la query que se esta ejecutando
     print(f"\n[INFO] Ejecutando JQL: {jql}")
 
-    # Consultamos Jira
-    issues = fetch_all_issues(
-        cfg["JIRA_BASE_URL"],
-        (cfg["JIRA_EMAIL"], cfg["JIRA_API_TOKEN"]),
-        jql
-    )
+    # Consultamos Jira en dos etapas:
+    # 1) solo `assignee` (respuesta mínima) para agrupar y muestrear.
+    #    Con JIRA_CACHE=1 se pide también `summary`: así el caché alcanza para
+    #    renderizar y las repeticiones no vuelven a consultar Jira.
+    auth = (cfg["JIRA_EMAIL"], cfg["JIRA_API_TOKEN"])
+    fetch_kwargs = {"max_results": cfg["JIRA_PAGE_SIZE"]}
+    use_cache = cache_enabled()
+    stage1_fields = ("summary", "assignee") if use_cache else ("assignee",)
+    issues = fetch_all_issues(cfg["JIRA_BASE_URL"], auth, jql, fields=stage1_fields, **fetch_kwargs)
+    issues = normalize_issues(issues, cfg["JIRA_BASE_URL"])
     
     print(f"[INFO] Issues recuperados: {len(issues)}")
-    summarize_assignee_stats(issues)
 
-    # Agrupamos por analista (incluye "Sin asignar") y seleccionamos N aleatorios
-    groups = group_by_assignee(issues)
-    selection = pick_random_per_analyst(groups, cfg["PER_ANALYST"])
+    # Agrupamos por analista (incluye "Sin asignar"), seleccionamos N aleatorios
+    # y contamos con/sin assignee en una sola pasada
+    selection, with_assignee, without_assignee = partition_issues(issues, cfg["PER_ANALYST"])
+    print(f"[INFO] Con assignee: {with_assignee} | Sin assignee: {without_assignee}")
+
+    # 2) solo los issues seleccionados, con los campos que se muestran
+    if not use_cache:
+        selection = hydrate_selection(cfg["JIRA_BASE_URL"], auth, selection, **fetch_kwargs)
+
+    # Ordenamos una sola vez por nombre del analista; consola y HTML usan la misma lista
+    ordered_selection = sorted(selection.items(), key=lambda kv: kv[0][1].lower())
     
     if cfg["DRY_RUN"]: 
         # 🔽 Imprimir resumen en consola para pruebas
-        print_console_summary(cfg["JIRA_BASE_URL"], selection, len(issues))        
+        print_console_summary(ordered_selection, len(issues))        
         
     
     # Fecha "ayer" (Bogotá) para asunto y HTML
     yesterday_bog = get_yesterday_bogota()
 
+    # En DRY_RUN el HTML va directo al archivo de vista previa
+    if cfg["DRY_RUN"]:
+        save_preview(cfg, yesterday_bog, ordered_selection, len(issues))
+        return
+
     # Construimos HTML y asunto (con nombres y links por issue)
-    html = build_email_html(cfg["JIRA_BASE_URL"], yesterday_bog, selection, len(issues))
+    html = build_email_html(yesterday_bog, ordered_selection, len(issues))
     subject = f"[Auditoría] Issues resueltos el {yesterday_bog.isoformat()}"
 
-    # Envío (o DRY_RUN)
+    # Envío
     send_email(cfg, subject, html)
 
 